@@ -4,73 +4,318 @@ Dolphin Document Parser API Server
 Provides REST API for ByteDance Dolphin document parsing
 """
 
-from flask import Flask, request, jsonify
-from flask_cors import CORS
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from PIL import Image
+import asyncio
 import io
 import base64
+import logging
+import shutil
 import sys
 import os
+import threading
 import torch
 import json
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from pathlib import Path
 
 # Add Dolphin to Python path
 sys.path.insert(0, '/app/dolphin')
 
-app = Flask(__name__)
-CORS(app)
+@asynccontextmanager
+async def lifespan(app):
+    """Preload (and compile) the model before serving, if configured"""
+    if COMPILE_MODEL or os.environ.get('DOLPHIN_PRELOAD', 'false').lower() == 'true':
+        await asyncio.to_thread(warm_up)
+    yield
+
+app = FastAPI(title='Dolphin Document Parser API', lifespan=lifespan)
+app.add_middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])
+
+logger = logging.getLogger('dolphin-api')
 
 # Initialize Dolphin model (lazy loading)
 dolphin_model = None
 dolphin_processor = None
+_model_lock = threading.Lock()
+
+# Serialises GPU work: one CUDA context, one generate() at a time
+_gpu_lock = threading.Lock()
+
+# CUDA stream used for host-to-device input copies (created with the model)
+copy_stream = None
+
+# Worker threads for CPU preprocessing, overlapped with GPU generation
+preproc_pool = ThreadPoolExecutor(max_workers=2)
+
+# Resolution PDF pages are rendered at (pdf2image defaults to 200)
+PDF_DPI = int(os.environ.get('PDF_DPI', 150))
+
+# Compile the decoder with torch.compile / CUDA graphs (slow first request)
+COMPILE_MODEL = os.environ.get('DOLPHIN_COMPILE', 'false').lower() == 'true'
+
+# Number of PDF pages decoded per generate() call
+PDF_BATCH_SIZE = max(1, int(os.environ.get('DOLPHIN_BATCH', 4)))
+
+class ResultCache:
+    """Thread-safe, bounded LRU cache of parse results keyed by content hash"""
+    
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+    
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+# Parsed results for previously seen images / PDF pages (0 disables caching)
+result_cache = ResultCache(int(os.environ.get('DOLPHIN_CACHE_SIZE', 256)))
+
+def content_hash(data):
+    """Hash raw input bytes for use as a cache key"""
+    return hashlib.blake2b(data, digest_size=32).hexdigest()
+
+def file_hash(path, chunk_size=1 << 20):
+    """Hash a file's content without reading it into memory at once"""
+    digest = hashlib.blake2b(digest_size=32)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
 
 def load_dolphin_model():
-    """Load Dolphin model on first request"""
-    global dolphin_model, dolphin_processor
+    """Load Dolphin model on first request (once per process)"""
+    global dolphin_model, dolphin_processor, copy_stream
     
     if dolphin_model is None:
-        try:
-            print("Loading Dolphin model...")
-            from transformers import VisionEncoderDecoderModel, AutoProcessor
-            
-            model_path = os.environ.get('MODEL_PATH', '/app/models')
-            
-            # Load processor and model
-            print(f"Loading from {model_path}")
-            dolphin_processor = AutoProcessor.from_pretrained(
-                model_path,
-                trust_remote_code=True
-            )
-            
-            dolphin_model = VisionEncoderDecoderModel.from_pretrained(
-                model_path,
-                trust_remote_code=True
-            )
-            
-            # Move to GPU if available
-            if torch.cuda.is_available():
-                dolphin_model = dolphin_model.cuda()
-                print("Model loaded on GPU")
-            else:
-                print("Model loaded on CPU (slower)")
-            
-            dolphin_model.eval()
-            print("Dolphin model loaded successfully")
-            
-        except Exception as e:
-            print(f"Error loading Dolphin model: {e}")
-            raise
+        # Handlers run this on asyncio.to_thread worker threads; without the
+        # lock concurrent first requests would each load a full copy of the weights
+        with _model_lock:
+            if dolphin_model is None:
+                try:
+                    print("Loading Dolphin model...")
+                    from transformers import VisionEncoderDecoderModel, AutoProcessor
+                    
+                    model_path = os.environ.get('MODEL_PATH', '/app/models')
+                    
+                    # Load processor and model
+                    print(f"Loading from {model_path}")
+                    processor = AutoProcessor.from_pretrained(
+                        model_path,
+                        trust_remote_code=True
+                    )
+                    
+                    model = VisionEncoderDecoderModel.from_pretrained(
+                        model_path,
+                        trust_remote_code=True
+                    )
+                    
+                    # Move to GPU if available (FP16 halves VRAM and bandwidth)
+                    if torch.cuda.is_available():
+                        torch.set_float32_matmul_precision('high')
+                        torch.backends.cudnn.benchmark = True
+                        model = model.half().cuda()
+                        copy_stream = torch.cuda.Stream()
+                        print("Model loaded on GPU (fp16)")
+                    else:
+                        print("Model loaded on CPU (slower)")
+                    
+                    model.eval()
+                    
+                    if COMPILE_MODEL:
+                        # The decoder step dominates greedy decoding; CUDA graphs
+                        # (reduce-overhead) need the fixed-size static KV cache
+                        model.generation_config.cache_implementation = 'static'
+                        model.decoder.forward = torch.compile(
+                            model.decoder.forward,
+                            mode='reduce-overhead',
+                            fullgraph=False
+                        )
+                        print("Decoder compiled with torch.compile (reduce-overhead)")
+                    
+                    # Publish only fully initialised objects to other threads
+                    dolphin_processor = processor
+                    dolphin_model = model
+                    print("Dolphin model loaded successfully")
+                    
+                except Exception as e:
+                    print(f"Error loading Dolphin model: {e}")
+                    raise
     
     return dolphin_model, dolphin_processor
 
-@app.route('/health', methods=['GET'])
-def health():
+def preprocess(processor, images):
+    """
+    CPU-side image preprocessing (resize/normalize)
+    
+    On GPU the tensors are placed in pinned host memory so the later
+    host-to-device copy can use DMA asynchronously.
+    """
+    inputs = processor(images=images, return_tensors="pt")
+    
+    if torch.cuda.is_available():
+        inputs = {k: v.pin_memory() for k, v in inputs.items()}
+    
+    return inputs
+
+def generate(model, processor, inputs):
+    """
+    Run Dolphin generation on preprocessed inputs
+    
+    Returns the decoded output text for each image, in input order.
+    """
+    if torch.cuda.is_available():
+        # Copy on a side stream, then make the compute stream wait for it
+        compute_stream = torch.cuda.current_stream()
+        with torch.cuda.stream(copy_stream):
+            inputs = {
+                k: v.to(
+                    'cuda',
+                    dtype=model.dtype if v.is_floating_point() else None,
+                    non_blocking=True
+                )
+                for k, v in inputs.items()
+            }
+        compute_stream.wait_stream(copy_stream)
+        for v in inputs.values():
+            v.record_stream(compute_stream)
+    
+    with _gpu_lock, torch.inference_mode():
+        outputs = model.generate(
+            **inputs,
+            max_new_tokens=2048,
+            do_sample=False,
+            num_beams=1
+        )
+    
+    return processor.batch_decode(outputs, skip_special_tokens=True)
+
+def run_inference(model, processor, images):
+    """Preprocess and run Dolphin on a batch of images in one generate() call"""
+    return generate(model, processor, preprocess(processor, images))
+
+def warm_up():
+    """Load the model and run one dummy page so compilation happens before serving"""
+    model, processor = load_dolphin_model()
+    print("Warming up Dolphin model...")
+    run_inference(model, processor, [Image.new('RGB', (896, 896), 'white')])
+    print("Warm-up complete")
+
+def parse_image(file_bytes, parse_layout, extract_tables):
+    """Parse a single document image (blocking; run off the event loop)"""
+    # Identical images with identical options give identical results
+    cache_key = f"{content_hash(file_bytes)}|{parse_layout}|{extract_tables}"
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        print("Returning cached result")
+        return cached
+    
+    image = Image.open(io.BytesIO(file_bytes))
+    
+    # Load model
+    model, processor = load_dolphin_model()
+    
+    # Prepare image for Dolphin
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    
+    # Run Dolphin parsing
+    print(f"Processing image size: {image.size}")
+    
+    # Process with Dolphin
+    generated_text = run_inference(model, processor, [image])[0]
+    
+    # Parse Dolphin's JSON output
+    try:
+        parsed_result = json.loads(generated_text)
+    except json.JSONDecodeError:
+        # If not JSON, return as plain text
+        parsed_result = {
+            'text': generated_text,
+            'layout': {'elements': [], 'reading_order': []},
+            'tables': []
+        }
+    
+    # Format result
+    result = {
+        'text': parsed_result.get('text', generated_text),
+        'layout': parsed_result.get('layout', {
+            'elements': parsed_result.get('elements', []),
+            'reading_order': parsed_result.get('reading_order', [])
+        }),
+        'tables': parsed_result.get('tables', []),
+        'metadata': {
+            'model': 'Dolphin-1.5',
+            'image_size': list(image.size),
+            'device': 'cuda' if torch.cuda.is_available() else 'cpu'
+        }
+    }
+    
+    result_cache.put(cache_key, result)
+    
+    print(f"Parsing complete. Text length: {len(result['text'])}")
+    return result
+
+class CleanupStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that runs cleanup once the response is over
+    
+    Unlike a generator's finally block or a BackgroundTask, this also runs
+    when the client disconnects before or during streaming.
+    """
+    
+    def __init__(self, content, cleanup, **kwargs):
+        super().__init__(content, **kwargs)
+        self.cleanup = cleanup
+    
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.cleanup()
+
+def save_upload(upload):
+    """Copy an uploaded file to a named temp file and return its path"""
+    import tempfile
+    
+    with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as tmp:
+        shutil.copyfileobj(upload.file, tmp, 1 << 20)
+        return tmp.name
+
+def is_multipart(request):
+    """Whether the request carries a multipart/urlencoded form body"""
+    content_type = request.headers.get('content-type', '')
+    return content_type.startswith(('multipart/form-data', 'application/x-www-form-urlencoded'))
+
+def form_flag(form, name, default):
+    """Read a 'true'/'false' form field"""
+    return str(form.get(name, default)).lower() == 'true'
+
+@app.get('/health')
+async def health():
     """Health check endpoint"""
-    return jsonify({'status': 'ok', 'service': 'dolphin-api'})
+    return {'status': 'ok', 'service': 'dolphin-api'}
 
-@app.route('/parse', methods=['POST'])
-def parse_document():
+@app.post('/parse')
+async def parse_document(request: Request):
     """
     Parse document image or PDF
     
@@ -89,90 +334,148 @@ def parse_document():
         }
     """
     try:
+        form = {}
+        
         # Get image from request
-        if 'file' in request.files:
-            file = request.files['file']
+        if is_multipart(request):
+            form = await request.form()
+            if 'file' not in form:
+                return JSONResponse({'error': 'No image provided. Send file or image_base64'}, status_code=400)
             # Read file content into memory to avoid tempfile issues
-            file_bytes = file.read()
-            image = Image.open(io.BytesIO(file_bytes))
-        elif request.json and 'image_base64' in request.json:
-            image_data = base64.b64decode(request.json['image_base64'])
-            image = Image.open(io.BytesIO(file_bytes))
+            file_bytes = await form['file'].read()
         else:
-            return jsonify({'error': 'No image provided. Send file or image_base64'}), 400
+            try:
+                body = await request.json()
+            except ValueError:
+                body = None
+            if not isinstance(body, dict) or 'image_base64' not in body:
+                return JSONResponse({'error': 'No image provided. Send file or image_base64'}, status_code=400)
+            file_bytes = base64.b64decode(body['image_base64'])
         
         # Get options
-        parse_layout = request.form.get('parse_layout', 'true').lower() == 'true'
-        extract_tables = request.form.get('extract_tables', 'true').lower() == 'true'
-        
-        # Load model
-        model, processor = load_dolphin_model()
-        
-        # Prepare image for Dolphin
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        
-        # Run Dolphin parsing
-        print(f"Processing image size: {image.size}")
+        parse_layout = form_flag(form, 'parse_layout', 'true')
+        extract_tables = form_flag(form, 'extract_tables', 'true')
         
-        # Process with Dolphin
-        inputs = processor(images=image, return_tensors="pt")
-        
-        if torch.cuda.is_available():
-            inputs = {k: v.cuda() for k, v in inputs.items()}
-        
-        # Generate output
-        with torch.no_grad():
-            outputs = model.generate(
-                **inputs,
-                max_new_tokens=2048,
-                do_sample=False
-            )
+        # Model work blocks, keep it off the event loop
+        result = await asyncio.to_thread(parse_image, file_bytes, parse_layout, extract_tables)
+        return result
+    
+    except Exception as e:
+        logger.error(f"Parse error: {str(e)}")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+def render_pages(processor, pdf_path, page_nums):
+    """
+    Render the given PDF pages one at a time and preprocess them
+    
+    Runs on preproc_pool, so rasterisation overlaps GPU generation and no
+    more than the pages of the in-flight batches are held in memory.
+    """
+    import pdf2image
+    
+    images = []
+    for page_num in page_nums:
+        [img] = pdf2image.convert_from_path(
+            pdf_path,
+            dpi=PDF_DPI,
+            first_page=page_num,
+            last_page=page_num
+        )
+        images.append(img)
+    
+    return preprocess(processor, images)
+
+def generate_pdf_pages(model, processor, pdf_path, page_nums):
+    """
+    Yield (page_num, result dict) for the given PDF page numbers
+    
+    Rendering and preprocessing of the next batch runs on preproc_pool while
+    the current batch is being generated.
+    """
+    batches = [page_nums[i:i + PDF_BATCH_SIZE] for i in range(0, len(page_nums), PDF_BATCH_SIZE)]
+    pending = preproc_pool.submit(render_pages, processor, pdf_path, batches[0]) if batches else None
+    
+    for index, batch in enumerate(batches):
+        print(f"Processing pages {batch[0]}-{batch[-1]}")
         
-        # Decode output
-        generated_text = processor.batch_decode(outputs, skip_special_tokens=True)[0]
+        inputs = pending.result()
+        if index + 1 < len(batches):
+            pending = preproc_pool.submit(render_pages, processor, pdf_path, batches[index + 1])
         
-        # Parse Dolphin's JSON output
-        try:
-            parsed_result = json.loads(generated_text)
-        except json.JSONDecodeError:
-            # If not JSON, return as plain text
-            parsed_result = {
-                'text': generated_text,
-                'layout': {'elements': [], 'reading_order': []},
-                'tables': []
-            }
+        # Process a batch of pages with Dolphin
+        texts = generate(model, processor, inputs)
         
-        # Format result
-        result = {
-            'text': parsed_result.get('text', generated_text),
-            'layout': parsed_result.get('layout', {
-                'elements': parsed_result.get('elements', []),
-                'reading_order': parsed_result.get('reading_order', [])
-            }),
-            'tables': parsed_result.get('tables', []),
-            'metadata': {
-                'model': 'Dolphin-1.5',
-                'image_size': list(image.size),
-                'device': 'cuda' if torch.cuda.is_available() else 'cpu'
+        for page_num, generated_text in zip(batch, texts):
+            try:
+                parsed = json.loads(generated_text)
+            except json.JSONDecodeError:
+                parsed = {'text': generated_text, 'layout': {}}
+            
+            yield page_num, {
+                'page': page_num,
+                'text': parsed.get('text', generated_text),
+                'layout': parsed.get('layout', {}),
+                'tables': parsed.get('tables', [])
             }
-        }
+
+def iter_pdf_pages(model, processor, pdf_path, total_pages, pdf_key):
+    """
+    Yield one parsed result dict per PDF page, in page order
+    
+    Pages already parsed for the same PDF content (pdf_key) come from the
+    result cache and are not even rendered; only the remaining pages are
+    run through the model.
+    """
+    cached = {}
+    missing = []
+    for page_num in range(1, total_pages + 1):
+        hit = result_cache.get(f"{pdf_key}|{page_num}")
+        if hit is not None:
+            cached[page_num] = hit
+        else:
+            missing.append(page_num)
+    
+    print(f"{len(cached)}/{total_pages} pages served from cache")
+    generated = generate_pdf_pages(model, processor, pdf_path, missing)
+    
+    for page_num in range(1, total_pages + 1):
+        if page_num in cached:
+            yield cached[page_num]
+            continue
         
-        print(f"Parsing complete. Text length: {len(result['text'])}")
-        return jsonify(result)
+        _, page = next(generated)
+        result_cache.put(f"{pdf_key}|{page_num}", page)
+        yield page
+
+def wants_stream(request, form):
+    """Whether the client asked for an NDJSON (one page per line) response"""
+    if form_flag(form, 'stream', request.query_params.get('stream', 'false')):
+        return True
+    return 'application/x-ndjson' in request.headers.get('accept', '')
+
+def prepare_pdf(pdf_path):
+    """Hash the PDF, read its page count and load the model (blocking)"""
+    import pdf2image
     
-    except Exception as e:
-        app.logger.error(f"Parse error: {str(e)}")
-        return jsonify({'error': str(e)}), 500
+    pdf_key = file_hash(pdf_path)
+    
+    # Pages are rendered lazily, one at a time, while parsing
+    total_pages = pdf2image.pdfinfo_from_path(pdf_path)['Pages']
+    
+    model, processor = load_dolphin_model()
+    
+    return pdf_key, total_pages, model, processor
 
-@app.route('/parse_pdf', methods=['POST'])
-def parse_pdf():
+@app.post('/parse_pdf')
+async def parse_pdf(request: Request):
     """
     Parse multi-page PDF document
     
     Request:
         - file: PDF file upload
         - pages: list of page numbers (optional, default=all)
+        - stream: bool (optional, default=False), same as sending
+          "Accept: application/x-ndjson"
     
     Response:
         {
@@ -182,78 +485,72 @@ def parse_pdf():
             ],
             "metadata": {...}
         }
+    
+    Streaming response (application/x-ndjson), one JSON object per line:
+        {"page": 1, "text": "...", "layout": {...}}
+        {"page": 2, "text": "...", "layout": {...}}
+        {"metadata": {...}}
     """
     try:
-        if 'file' not in request.files:
-            return jsonify({'error': 'No PDF file provided'}), 400
-        
-        file = request.files['file']
+        form = await request.form() if is_multipart(request) else {}
+        if 'file' not in form:
+            return JSONResponse({'error': 'No PDF file provided'}, status_code=400)
         
         # Save PDF temporarily
-        import tempfile
-        import pdf2image
+        pdf_path = await asyncio.to_thread(save_upload, form['file'])
         
-        with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as tmp:
-            file.save(tmp.name)
-            pdf_path = tmp.name
+        # The streaming response takes over temp file cleanup
+        streaming = False
         
         try:
-            # Convert PDF to images
-            images = pdf2image.convert_from_path(pdf_path)
+            pdf_key, total_pages, model, processor = await asyncio.to_thread(prepare_pdf, pdf_path)
             
-            model, processor = load_dolphin_model()
-            
-            pages_result = []
+            metadata = {
+                'model': 'Dolphin-1.5',
+                'total_pages': total_pages,
+                'device': 'cuda' if torch.cuda.is_available() else 'cpu'
+            }
             
-            for page_num, img in enumerate(images, 1):
-                print(f"Processing page {page_num}/{len(images)}")
-                
-                # Process image with Dolphin
-                inputs = processor(images=img, return_tensors="pt")
-                
-                if torch.cuda.is_available():
-                    inputs = {k: v.cuda() for k, v in inputs.items()}
-                
-                with torch.no_grad():
-                    outputs = model.generate(**inputs, max_new_tokens=2048, do_sample=False)
-                
-                generated_text = processor.batch_decode(outputs, skip_special_tokens=True)[0]
+            if wants_stream(request, form):
+                # Sync generator: Starlette iterates it in a worker thread
+                def generate_lines():
+                    try:
+                        for page in iter_pdf_pages(model, processor, pdf_path, total_pages, pdf_key):
+                            yield json.dumps(page) + '\n'
+                        yield json.dumps({'metadata': metadata}) + '\n'
+                    except Exception as e:
+                        logger.error(f"PDF stream error: {str(e)}")
+                        yield json.dumps({'error': str(e)}) + '\n'
                 
-                try:
-                    parsed = json.loads(generated_text)
-                except json.JSONDecodeError:
-                    parsed = {'text': generated_text, 'layout': {}}
-                
-                pages_result.append({
-                    'page': page_num,
-                    'text': parsed.get('text', generated_text),
-                    'layout': parsed.get('layout', {}),
-                    'tables': parsed.get('tables', [])
-                })
+                streaming = True
+                return CleanupStreamingResponse(
+                    generate_lines(),
+                    cleanup=lambda: os.unlink(pdf_path),
+                    media_type='application/x-ndjson'
+                )
             
-            result = {
-                'pages': pages_result,
-                'metadata': {
-                    'model': 'Dolphin-1.5',
-                    'total_pages': len(images),
-                    'device': 'cuda' if torch.cuda.is_available() else 'cpu'
-                }
-            }
+            pages = await asyncio.to_thread(
+                lambda: list(iter_pdf_pages(model, processor, pdf_path, total_pages, pdf_key))
+            )
             
-            return jsonify(result)
+            return {
+                'pages': pages,
+                'metadata': metadata
+            }
             
         finally:
             # Clean up temp file
-            os.unlink(pdf_path)
+            if not streaming:
+                os.unlink(pdf_path)
     
     except Exception as e:
-        app.logger.error(f"PDF parse error: {str(e)}")
-        return jsonify({'error': str(e)}), 500
+        logger.error(f"PDF parse error: {str(e)}")
+        return JSONResponse({'error': str(e)}, status_code=500)
 
-@app.route('/info', methods=['GET'])
-def info():
+@app.get('/info')
+async def info():
     """Get model information"""
-    return jsonify({
+    return {
         'model': 'ByteDance Dolphin-1.5',
         'version': '1.5',
         'capabilities': [
@@ -264,9 +561,12 @@ def info():
             'ocr'
         ],
         'model_path': '/app/models'
-    })
+    }
 
 if __name__ == '__main__':
+    import uvicorn
+    
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port, debug=False)
-
+    # One worker keeps a single model copy and CUDA context; the event loop
+    # (uvloop/httptools when installed) provides connection concurrency
+    uvicorn.run(app, host='0.0.0.0', port=port, workers=1)
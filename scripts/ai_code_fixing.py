@@ -5,9 +5,150 @@ This module adds PHPCS parsing and file manipulation endpoints
 to support AI-powered code fixing workflows.
 """
 import json
+import os
 import subprocess
 import re
-from typing import Dict, Any, List
+import shlex
+import shutil
+import tempfile
+import threading
+from collections import defaultdict
+from datetime import datetime
+from types import MappingProxyType
+from typing import Dict, Any, List, Optional
+
+# Prefer orjson for the large PHPCS reports; fall back to stdlib json.
+try:
+    import orjson as _json
+except ImportError:
+    _json = json
+
+# Optional incremental JSON parser for streaming the PHPCS report.
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# Maximum PHPCS runtime in seconds.
+PHPCS_TIMEOUT = 60
+
+# Container app path prefix stripped from PHPCS file paths.
+APP_PREFIX = '/var/www/html/apps-extra/openregister/'
+_APP_PREFIX_LEN = len(APP_PREFIX)
+
+# Allowed file paths: relative, no '..' anywhere, conservative charset.
+_SAFE_PATH = re.compile(r'(?!.*\.\.)(?!/)[A-Za-z0-9_./-]+')
+
+# Host directory the container app path is bind-mounted on (optional).
+# When set, file operations bypass `docker exec` entirely.
+HOST_APP_PATH = os.environ.get('HOST_APP_PATH', '')
+
+# Process umask, read once at import (setting it is the only way to read it,
+# which is not safe once request threads run).
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def _is_safe_path(file_path: Any) -> bool:
+    """
+    Check that a requested path stays inside the app directory.
+    
+    :param file_path: Path from the request body.
+    :return: True if the path is a safe relative path.
+    """
+    return isinstance(file_path, str) and _SAFE_PATH.fullmatch(file_path) is not None
+
+
+def _host_path(file_path: str) -> Optional[str]:
+    """
+    Resolve a relative app path on the host bind mount.
+    
+    Symlinks are resolved here, on the host, so the result is the file that
+    would actually be read or written.
+    
+    :param file_path: Relative path inside the app directory.
+    :return: Absolute real host path, or None if no bind mount is available.
+    """
+    if not HOST_APP_PATH or not os.path.isdir(HOST_APP_PATH):
+        return None
+    
+    return os.path.realpath(os.path.join(HOST_APP_PATH, file_path))
+
+
+def _inside_app(host_path: str) -> bool:
+    """
+    Check that a resolved host path is inside the bind-mounted app directory.
+    
+    _is_safe_path only vets the requested string; a symlink in the app tree
+    can still point anywhere on the host.
+    
+    :param host_path: Path returned by _host_path.
+    :return: True if the path lies below HOST_APP_PATH.
+    """
+    return host_path.startswith(os.path.realpath(HOST_APP_PATH) + os.sep)
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    """
+    Write data to a file atomically (temp file + fsync + rename).
+    
+    A crash mid-write leaves the original file untouched. A symlinked path
+    is resolved first, so the link target is replaced, not the link (callers
+    check that target stays inside the app directory). The new file keeps the replaced file's mode and owner; a new file gets the
+    mode open() would give it (0666 less the umask).
+    
+    :param path: Destination path.
+    :param data: Content to write.
+    """
+    path = os.path.realpath(path)
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            os.chmod(tmp_path, 0o666 & ~_UMASK)
+        else:
+            os.chmod(tmp_path, st.st_mode & 0o7777)
+            try:
+                os.chown(tmp_path, st.st_uid, st.st_gid)
+            except PermissionError:
+                # Only root may give a file away; the mode is still kept.
+                pass
+        
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def _snapshot(src: str, dst: str) -> None:
+    """
+    Create a read-only backup of src at dst without spawning a process.
+    
+    The data is copied in-kernel by shutil.copyfile. A hardlink is not used:
+    phpcbf, cs:fix and the docker `cat >` fallback rewrite files in place,
+    which would change a linked backup along with the original.
+    
+    An existing (read-only) backup of the same name, e.g. from a second
+    backup within the same second, is replaced, as the docker `cp`
+    fallback would do.
+    
+    :param src: Path of the file to back up.
+    :param dst: Path of the backup.
+    """
+    try:
+        os.unlink(dst)
+    except FileNotFoundError:
+        pass
+    shutil.copyfile(src, dst)
+    os.chmod(dst, 0o444)
 
 
 def process_phpcs_result(result: subprocess.CompletedProcess) -> Dict[str, Any]:
@@ -20,40 +161,50 @@ def process_phpcs_result(result: subprocess.CompletedProcess) -> Dict[str, Any]:
     :param result: The completed subprocess result.
     :return: Structured PHPCS issues for AI processing.
     """
+    issues_by_file = []
+    total_errors = 0
+    total_warnings = 0
+    
+    # Run PHPCS with JSON output and parse it straight off the pipe.
     try:
-        # Run PHPCS with JSON output.
-        json_result = subprocess.run(
+        proc = subprocess.Popen(
             [
                 'docker', 'exec', 'master-nextcloud-1', 'bash', '-c',
                 'cd /var/www/html/apps-extra/openregister && '
                 './vendor/bin/phpcs --report=json --standard=PSR12 lib/ 2>&1'
             ],
-            capture_output=True,
-            text=True,
-            timeout=60
+            stdout=subprocess.PIPE
         )
-        
-        # Parse PHPCS JSON.
-        phpcs_data = json.loads(json_result.stdout)
+    except OSError as e:
+        return {
+            "phpcs_issues": [],
+            "error": f"Failed to parse PHPCS output: {str(e)}"
+        }
+    
+    # Hard timeout: kill PHPCS even while we are blocked reading its output.
+    timed_out = threading.Event()
+    
+    def _kill_on_timeout() -> None:
+        timed_out.set()
+        proc.kill()
+    
+    timer = threading.Timer(PHPCS_TIMEOUT, _kill_on_timeout)
+    timer.start()
+    
+    try:
+        if ijson is not None:
+            # Files are aggregated as PHPCS emits them, one entry in memory at a time.
+            files = ijson.kvitems(proc.stdout, 'files')
+        else:
+            files = _json.loads(proc.stdout.read()).get('files', {}).items()
         
         # Extract issues per file.
-        issues_by_file = []
-        total_errors = 0
-        total_warnings = 0
-        
-        for filepath, file_data in phpcs_data.get('files', {}).items():
+        for filepath, file_data in files:
             if file_data['errors'] > 0 or file_data['warnings'] > 0:
-                # Get the messages for this file.
-                messages = file_data.get('messages', [])
-                
                 # Group by line for easier fixing.
-                issues_by_line = {}
-                for msg in messages:
-                    line = msg['line']
-                    if line not in issues_by_line:
-                        issues_by_line[line] = []
-                    
-                    issues_by_line[line].append({
+                issues_by_line = defaultdict(list)
+                for msg in file_data.get('messages', []):
+                    issues_by_line[msg['line']].append({
                         'column': msg['column'],
                         'type': msg['type'],
                         'severity': msg['severity'],
@@ -64,16 +215,20 @@ def process_phpcs_result(result: subprocess.CompletedProcess) -> Dict[str, Any]:
                 
                 issues_by_file.append({
                     'file': filepath,
-                    'relative_path': filepath.replace('/var/www/html/apps-extra/openregister/', ''),
+                    'relative_path': (
+                        filepath[_APP_PREFIX_LEN:] if filepath.startswith(APP_PREFIX) else filepath
+                    ),
                     'errors': file_data['errors'],
                     'warnings': file_data['warnings'],
                     'fixable': file_data['fixable'],
-                    'issues_by_line': issues_by_line
+                    'issues_by_line': dict(issues_by_line)
                 })
                 
                 total_errors += file_data['errors']
                 total_warnings += file_data['warnings']
         
+        proc.wait(timeout=PHPCS_TIMEOUT)
+        
         return {
             "phpcs_issues": issues_by_file,
             "totals": {
@@ -84,15 +239,25 @@ def process_phpcs_result(result: subprocess.CompletedProcess) -> Dict[str, Any]:
             "ready_for_ai_fixing": len(issues_by_file) > 0
         }
         
-    except (json.JSONDecodeError, subprocess.TimeoutExpired, Exception) as e:
+    except Exception as e:
+        if timed_out.is_set():
+            e = subprocess.TimeoutExpired(proc.args, PHPCS_TIMEOUT)
+        
         return {
             "phpcs_issues": [],
             "error": f"Failed to parse PHPCS output: {str(e)}"
         }
+    
+    finally:
+        timer.cancel()
+        if proc.poll() is None:
+            proc.kill()
+        proc.stdout.close()
+        proc.wait()
 
 
-# Command configurations for AI-powered code fixing.
-AI_COMMANDS = {
+# Command configurations for AI-powered code fixing (read-only).
+AI_COMMANDS = MappingProxyType({
     'phpcs-detailed': {
         'name': 'phpcs-detailed',
         'command': './vendor/bin/phpcs --report=json --standard=PSR12 lib/',
@@ -124,7 +289,7 @@ AI_COMMANDS = {
         'description': 'Create a backup of a file before AI fixes',
         'handler': 'backup_file_handler'
     }
-}
+})
 
 
 def read_file_handler(request_body: Dict[str, Any]) -> Dict[str, Any]:
@@ -134,16 +299,37 @@ def read_file_handler(request_body: Dict[str, Any]) -> Dict[str, Any]:
     :param request_body: Should contain {"file": "relative/path/to/file.php"}
     :return: File content and metadata.
     """
-    if 'file' not in request_body:
+    file_path = request_body.get('file')
+    if not file_path:
         return {"error": "Missing 'file' parameter in request body"}
     
-    file_path = request_body['file']
-    
     # Security: prevent path traversal.
-    if '..' in file_path or file_path.startswith('/'):
+    if not _is_safe_path(file_path):
         return {"error": "Invalid file path"}
     
     try:
+        host_path = _host_path(file_path)
+        if host_path is not None:
+            if not _inside_app(host_path):
+                return {"error": "Invalid file path"}
+            
+            # Direct read from the bind mount, no process spawn.
+            try:
+                with open(host_path, 'rb', buffering=0) as f:
+                    content = f.read().decode('utf-8')
+            except OSError as e:
+                return {
+                    "error": "File not found or not readable",
+                    "stderr": str(e)
+                }
+            
+            return {
+                "file": file_path,
+                "content": content,
+                "size": len(content),
+                "lines": len(content.split('\n'))
+            }
+        
         result = subprocess.run(
             [
                 'docker', 'exec', 'master-nextcloud-1', 'bash', '-c',
@@ -178,33 +364,53 @@ def write_file_handler(request_body: Dict[str, Any]) -> Dict[str, Any]:
     :param request_body: Should contain {"file": "path", "content": "..."}
     :return: Write status.
     """
-    if 'file' not in request_body or 'content' not in request_body:
+    file_path = request_body.get('file')
+    content = request_body.get('content')
+    if not file_path or content is None:
         return {"error": "Missing 'file' or 'content' parameter"}
     
-    file_path = request_body['file']
-    content = request_body['content']
-    
     # Security: prevent path traversal.
-    if '..' in file_path or file_path.startswith('/'):
+    if not _is_safe_path(file_path):
         return {"error": "Invalid file path"}
     
     try:
-        # Write content to temp file, then move it.
-        # Using heredoc for safe content transfer.
+        host_path = _host_path(file_path)
+        if host_path is not None:
+            if not _inside_app(host_path):
+                return {"error": "Invalid file path"}
+            
+            try:
+                _write_atomic(host_path, content.encode('utf-8'))
+            except OSError as e:
+                return {
+                    "error": "Failed to write file",
+                    "stderr": str(e)
+                }
+            
+            return {
+                "file": file_path,
+                "bytes_written": len(content),
+                "lines_written": len(content.split('\n')),
+                "status": "success"
+            }
+        
+        # Pipe content through stdin so arbitrary payloads (including a
+        # literal "EOF" line) arrive byte-for-byte without shell quoting.
+        target = shlex.quote(f'/var/www/html/apps-extra/openregister/{file_path}')
         result = subprocess.run(
             [
-                'docker', 'exec', 'master-nextcloud-1', 'bash', '-c',
-                f'cat > /var/www/html/apps-extra/openregister/{file_path} << \'EOF\'\n{content}\nEOF'
+                'docker', 'exec', '-i', 'master-nextcloud-1', 'sh', '-c',
+                f'cat > {target}'
             ],
+            input=content.encode('utf-8'),
             capture_output=True,
-            text=True,
             timeout=10
         )
         
         if result.returncode != 0:
             return {
                 "error": "Failed to write file",
-                "stderr": result.stderr
+                "stderr": result.stderr.decode('utf-8', errors='replace')
             }
         
         return {
@@ -225,20 +431,39 @@ def backup_file_handler(request_body: Dict[str, Any]) -> Dict[str, Any]:
     :param request_body: Should contain {"file": "relative/path/to/file.php"}
     :return: Backup status and location.
     """
-    if 'file' not in request_body:
+    file_path = request_body.get('file')
+    if not file_path:
         return {"error": "Missing 'file' parameter"}
     
-    file_path = request_body['file']
-    
     # Security check.
-    if '..' in file_path or file_path.startswith('/'):
+    if not _is_safe_path(file_path):
         return {"error": "Invalid file path"}
     
     try:
-        from datetime import datetime
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         backup_path = f"{file_path}.backup_{timestamp}"
         
+        host_path = _host_path(file_path)
+        if host_path is not None:
+            host_backup_path = _host_path(backup_path)
+            if not (_inside_app(host_path) and _inside_app(host_backup_path)):
+                return {"error": "Invalid file path"}
+            
+            try:
+                _snapshot(host_path, host_backup_path)
+            except OSError as e:
+                return {
+                    "error": "Failed to create backup",
+                    "stderr": str(e)
+                }
+            
+            return {
+                "original_file": file_path,
+                "backup_file": backup_path,
+                "timestamp": timestamp,
+                "status": "success"
+            }
+        
         result = subprocess.run(
             [
                 'docker', 'exec', 'master-nextcloud-1', 'bash', '-c',
@@ -0,0 +1,247 @@
+"""
+Shared helpers for the container API servers.
+
+JSON encoding, response timestamps, docker exec argv building and the
+tuned HTTP server used by container-api.py and container-api-ai.py
+(phpqa-api.py uses the JSON helpers), and the persistent container shell
+shared by container-api-ai.py and phpqa-api.py.
+"""
+import json
+import os
+import re
+import selectors
+import shlex
+import socket
+import subprocess
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer
+from typing import Any, Callable, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+# orjson is optional; it is much faster on the large PHPCS/phpqa reports.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Server processes; more than one bind PORT with SO_REUSEPORT (see TunedHTTPServer).
+API_WORKERS = max(1, int(os.environ.get('API_WORKERS', '1')))
+
+# Shell syntax: pipes, redirects, expansions, globs, lists, comments and
+# leading VAR=value assignments.
+SHELL_META_RE = re.compile(r'[|&;<>$`*?\[\]{}()~\\\n#!]|^\s*\w+=')
+
+
+def dumps(data: Any, pretty: bool = False) -> bytes:
+    """Serialise data to JSON bytes, with orjson when it is installed."""
+    if orjson is not None:
+        # PHPCS issues are keyed by (int) line number.
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if pretty else 0)
+        return orjson.dumps(data, option=option)
+    if pretty:
+        return json.dumps(data, indent=2).encode()
+    return json.dumps(data, separators=(',', ':')).encode()
+
+
+# Both raise a json.JSONDecodeError subclass on bad input.
+loads = orjson.loads if orjson is not None else json.loads
+
+
+# Response timestamps change once per second; format each second only once.
+_iso_cache: Tuple[int, str] = (0, '')
+
+
+def now_iso() -> str:
+    """Return the current UTC time as an ISO 8601 string ending in Z."""
+    global _iso_cache
+    
+    now = int(time.time())
+    second, text = _iso_cache
+    if now != second:
+        text = datetime.fromtimestamp(now, tz=timezone.utc).isoformat().replace('+00:00', 'Z')
+        # One tuple assignment, so concurrent readers never see a torn pair.
+        _iso_cache = (now, text)
+    return text
+
+
+def command_argv(command: str, container: str, workdir: str) -> List[str]:
+    """
+    Build the docker exec argv running command in workdir.
+    
+    Plain commands are exec'd directly with --workdir, skipping a bash
+    process; anything with shell syntax still goes through bash -c.
+    stderr is merged by the caller (stderr=subprocess.STDOUT).
+    
+    :param command: The command line to run.
+    :param container: The container name.
+    :param workdir: The working directory inside the container.
+    :return: The argv for subprocess.
+    """
+    if SHELL_META_RE.search(command):
+        return ['docker', 'exec', '--workdir', workdir, container, 'bash', '-c', command]
+    return ['docker', 'exec', '--workdir', workdir, container] + shlex.split(command)
+
+
+class ContainerShell:
+    """
+    A long-lived `docker exec -i bash` session that runs commands in turn.
+    
+    Saves the namespace setup of a fresh `docker exec` per call. Each command
+    runs in a subshell with stdin from /dev/null, so it can neither change the
+    session's state nor read the next command, and a unique marker line
+    carrying $? ends its output. Not thread-safe: callers give each thread its
+    own shell or hold a lock around run().
+    """
+    
+    def __init__(self, container: str):
+        self.container = container
+        self._process: Optional[subprocess.Popen] = None
+    
+    def close(self) -> None:
+        """Kill the session; the next run() starts a fresh one."""
+        if self._process is not None:
+            self._process.kill()
+            self._process.wait()
+            self._process = None
+    
+    def run(self, command: str, timeout: float,
+            on_line: Optional[Callable[[str], None]] = None) -> Tuple[int, bytes]:
+        """
+        Run command in the session and return (exit code, output).
+        
+        With on_line, output is handed over as it arrives, one line at a time
+        (newline included, except on an unterminated last line), and the
+        returned output is empty. On timeout the session is killed and
+        subprocess.TimeoutExpired is raised; OSError means the session died.
+        
+        :param command: The shell command to run.
+        :param timeout: Seconds to wait for the command to finish.
+        :param on_line: Optional callback receiving each output line.
+        :return: The exit code and, without on_line, the output.
+        """
+        if self._process is None or self._process.poll() is not None:
+            self._process = subprocess.Popen(
+                ['docker', 'exec', '-i', self.container, 'bash'],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                bufsize=0
+            )
+        
+        marker = f'__END_{uuid.uuid4().hex}__'
+        script = f'( {command}\n) </dev/null; printf \'\\n%s%d\\n\' {marker} $?\n'
+        try:
+            self._process.stdin.write(script.encode('utf-8'))
+        except BrokenPipeError:
+            self.close()
+            raise OSError("Container shell exited unexpectedly")
+        
+        fd = self._process.stdout.fileno()
+        buffer = bytearray()
+        needle = b'\n' + marker.encode()
+        deadline = time.monotonic() + timeout
+        
+        with selectors.DefaultSelector() as selector:
+            selector.register(fd, selectors.EVENT_READ)
+            while True:
+                # Only the tail can hold a marker that straddles two reads.
+                start = max(0, len(buffer) - len(needle) - 16)
+                
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not selector.select(remaining):
+                    self.close()
+                    raise subprocess.TimeoutExpired(command, timeout)
+                
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    self.close()
+                    raise OSError("Container shell exited unexpectedly")
+                buffer += chunk
+                
+                index = buffer.find(needle, start)
+                status_end = -1 if index == -1 else buffer.find(b'\n', index + len(needle))
+                
+                if on_line is not None:
+                    # A newline too close to the end may still turn out to
+                    # be the start of the marker; hold those lines back.
+                    limit = index if index != -1 else len(buffer) - len(needle) + 1
+                    cut = buffer.rfind(b'\n', 0, max(0, limit)) + 1
+                    if cut:
+                        for line in buffer[:cut].decode('utf-8', errors='replace').split('\n')[:-1]:
+                            on_line(line + '\n')
+                        del buffer[:cut]
+                        index -= cut
+                        status_end -= cut
+                
+                if status_end >= 0:
+                    exit_code = int(buffer[index + len(needle):status_end])
+                    output = bytes(buffer[:index])
+                    if on_line is None:
+                        return exit_code, output
+                    if output:
+                        on_line(output.decode('utf-8', errors='replace'))
+                    return exit_code, b''
+
+
+class RequestHelpersMixin:
+    """Request parsing shared by the BaseHTTPRequestHandler subclasses."""
+    
+    # Set per request by _route from a ?pretty=1 query flag.
+    _pretty = False
+    
+    def _route(self) -> str:
+        """
+        Return the endpoint name from the request path.
+        
+        Strips the leading slash and the query string, noting ?pretty=1.
+        """
+        url = urlsplit(self.path)
+        self._pretty = parse_qs(url.query).get('pretty') == ['1']
+        return url.path.lstrip('/')
+    
+    def _read_body(self, content_length: Optional[int] = None) -> bytearray:
+        """
+        Read the request body straight into one preallocated buffer.
+        
+        :param content_length: The Content-Length, if already parsed.
+        :return: The body; shorter than content_length if the client hung up.
+        """
+        if content_length is None:
+            content_length = int(self.headers.get('Content-Length', 0))
+        buf = bytearray(content_length)
+        view = memoryview(buf)
+        received = 0
+        while received < content_length:
+            count = self.rfile.readinto(view[received:])
+            if not count:
+                # Client closed early; the truncated body fails to parse.
+                del view
+                del buf[received:]
+                break
+            received += count
+        return buf
+
+
+class TunedHTTPServer(ThreadingHTTPServer):
+    """
+    ThreadingHTTPServer with Nagle disabled and, for API_WORKERS > 1,
+    SO_REUSEPORT set.
+    
+    With SO_REUSEPORT several worker processes can each bind PORT and the
+    kernel spreads incoming connections across them. A single worker leaves
+    it off, so an accidental second server fails with EADDRINUSE instead of
+    silently taking half the traffic.
+    """
+    
+    def server_bind(self):
+        if API_WORKERS > 1 and hasattr(socket, 'SO_REUSEPORT'):
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+    
+    def get_request(self):
+        # Headers and body go out as separate writes; don't let Nagle hold them back.
+        conn, addr = super().get_request()
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return conn, addr
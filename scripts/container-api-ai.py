@@ -4,19 +4,266 @@ OpenRegister Container API with AI Code Fixing Support.
 
 Includes PHPCS analysis, file operations, and integration with Ollama LLM.
 """
+import hashlib
 import json
+import posixpath
 import subprocess
 import sys
-import re
+import os
+import shlex
+import threading
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from http.server import BaseHTTPRequestHandler, HTTPServer
-from typing import Dict, Any
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler
+from typing import Dict, Any, List, Optional, Tuple
+
+from api_common import (
+    API_WORKERS,
+    ContainerShell,
+    RequestHelpersMixin,
+    TunedHTTPServer,
+    command_argv,
+    dumps,
+    loads,
+    now_iso
+)
+
+# The docker SDK is optional; without it we shell out to the docker CLI.
+try:
+    import docker
+except ImportError:
+    docker = None
+
+# requests is only needed for the Ollama-backed /ai-fix-code endpoint.
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+except ImportError:
+    requests = None
 
 PORT = 9090
 CONTAINER_NAME = 'master-nextcloud-1'
 APP_PATH = '/var/www/html/apps-extra/openregister'
 OLLAMA_URL = 'http://localhost:11434'
 
+# Concurrent POST requests allowed; further requests queue for a slot.
+MAX_CONCURRENT_REQUESTS = 32
+_request_slots = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
+
+# Endpoints that take a JSON request body describing file(s).
+FILE_OPERATIONS = ('read-file', 'write-file', 'backup-file', 'read-files', 'backup-files')
+
+# Timeout in seconds for multi-file operations.
+BATCH_TIMEOUT = 30
+
+# Keep-alive connections to Ollama, shared by all request threads.
+OLLAMA_POOL_SIZE = 32
+_ollama_session = None
+if requests is not None:
+    _ollama_session = requests.Session()
+    _ollama_session.mount('http://', HTTPAdapter(pool_connections=8, pool_maxsize=OLLAMA_POOL_SIZE))
+
+# Concurrent Ollama calls per /ai-fix-code-batch request.
+AI_FIX_WORKERS = 8
+
+
+# ============================================================================
+# CONTAINER ACCESS
+# ============================================================================
+
+_container = None
+_container_lock = threading.Lock()
+
+
+def _get_container():
+    """Return a cached docker SDK container handle, or None if unavailable."""
+    global _container
+    
+    if _container is None and docker is not None:
+        # Requests are served on threads; connect only once.
+        with _container_lock:
+            if _container is None:
+                try:
+                    _container = docker.from_env().containers.get(CONTAINER_NAME)
+                except Exception as e:
+                    print(f"[{datetime.now()}] Docker SDK unavailable, using CLI: {e}", file=sys.stderr)
+    
+    return _container
+
+
+# One shared session; _shell_lock runs its commands one at a time.
+_shell = ContainerShell(CONTAINER_NAME)
+_shell_lock = threading.Lock()
+
+
+def _exec(cmd: str, timeout: float) -> Tuple[int, bytes]:
+    """
+    Run cmd in the persistent container shell and return (exit code, stdout).
+    
+    Commands run one at a time, so only short ones belong here. On timeout
+    the shell is killed and subprocess.TimeoutExpired is raised.
+    """
+    with _shell_lock:
+        return _shell.run(cmd, timeout)
+
+
+def _container_exec(shell_cmd: str, timeout: int = 10) -> Tuple[int, str]:
+    """
+    Run a short shell command in the container.
+    
+    Goes through the persistent shell (see _exec). If the docker CLI cannot be
+    started, uses the pooled docker SDK connection, whose exec_run has no
+    timeout, and finally falls back to a one-off `docker exec`.
+    """
+    try:
+        exit_code, stdout = _exec(shell_cmd, timeout)
+        return exit_code, stdout.decode('utf-8')
+    except OSError as e:
+        print(f"[{datetime.now()}] Container shell unavailable: {e}", file=sys.stderr)
+    
+    container = _get_container()
+    if container is not None:
+        exit_code, (stdout, _stderr) = container.exec_run(['bash', '-c', shell_cmd], demux=True)
+        return exit_code, (stdout or b'').decode('utf-8')
+    
+    result = subprocess.run(
+        ['docker', 'exec', CONTAINER_NAME, 'bash', '-c', shell_cmd],
+        capture_output=True,
+        text=True,
+        timeout=timeout
+    )
+    return result.returncode, result.stdout
+
+
+def _resolve_app_path(file_path: str) -> Optional[str]:
+    """Return the absolute container path for file_path if it stays inside APP_PATH."""
+    if not file_path or not isinstance(file_path, str):
+        return None
+    
+    return _normalize_app_path(file_path)
+
+
+@lru_cache(maxsize=1024)
+def _normalize_app_path(file_path: str) -> Optional[str]:
+    """Join and normalise file_path under APP_PATH; None if it escapes or has a NUL."""
+    if '\0' in file_path:
+        return None
+    
+    # Absolute paths and ".." segments are resolved before the prefix check.
+    full_path = posixpath.normpath(posixpath.join(APP_PATH, file_path))
+    if not full_path.startswith(APP_PATH + '/'):
+        return None
+    
+    return full_path
+
+
+def _count_lines(text: str) -> int:
+    """Count lines, including an unterminated last line, without splitting."""
+    if not text:
+        return 0
+    return text.count('\n') + (0 if text.endswith('\n') else 1)
+
+
+# ============================================================================
+# RESULT CACHE
+# ============================================================================
+
+# Command responses keyed by (command, input fingerprint), most recent last.
+RESULT_CACHE_SIZE = 16
+_result_cache: 'OrderedDict[Tuple[str, str], Dict[str, Any]]' = OrderedDict()
+_result_cache_lock = threading.Lock()
+
+
+def _result_cache_get(key: Tuple[str, str]):
+    """Return a cached command response, or None."""
+    with _result_cache_lock:
+        response = _result_cache.get(key)
+        if response is not None:
+            _result_cache.move_to_end(key)
+        return response
+
+
+def _result_cache_put(key: Tuple[str, str], response: Dict[str, Any]) -> None:
+    """Store a command response, evicting the least recently used entry."""
+    with _result_cache_lock:
+        _result_cache[key] = response
+        _result_cache.move_to_end(key)
+        while len(_result_cache) > RESULT_CACHE_SIZE:
+            _result_cache.popitem(last=False)
+
+
+# read-file responses keyed by path, each stored with the ETag it was read at.
+FILE_CACHE_SIZE = 64
+_file_cache: 'OrderedDict[str, Tuple[str, Dict[str, Any]]]' = OrderedDict()
+_file_cache_lock = threading.Lock()
+
+# Inode, size and nanosecond mtime: a replaced or rewritten file gets a new ETag.
+_STAT_FORMAT = "'%i %s %y'"
+
+
+def _etag(stat_line: str) -> str:
+    """Build a strong ETag from a _STAT_FORMAT line."""
+    return '"' + hashlib.blake2b(stat_line.strip().encode(), digest_size=8).hexdigest() + '"'
+
+
+def _file_cache_get(file_path: str, etag: str):
+    """Return the cached read-file response for file_path at etag, or None."""
+    with _file_cache_lock:
+        entry = _file_cache.get(file_path)
+        if entry is None or entry[0] != etag:
+            return None
+        _file_cache.move_to_end(file_path)
+        return entry[1]
+
+
+def _file_cache_put(file_path: str, etag: str, response: Dict[str, Any]) -> None:
+    """Store a read-file response, replacing older versions of the same file."""
+    with _file_cache_lock:
+        _file_cache[file_path] = (etag, response)
+        _file_cache.move_to_end(file_path)
+        while len(_file_cache) > FILE_CACHE_SIZE:
+            _file_cache.popitem(last=False)
+
+# ============================================================================
+# AI FIXING
+# ============================================================================
+
+def _fix_prompt(issues: Any, content: str) -> str:
+    """Build the Ollama prompt asking for a PSR-12 fix of content."""
+    return f"""Fix this PHP code according to PSR-12 standards.
+
+Issues found:
+{json.dumps(issues, indent=2)}
+
+Current code:
+```php
+{content}
+```
+
+Provide ONLY the fixed PHP code, no explanations."""
+
+
+def _extract_code(completion: str) -> str:
+    """Strip a markdown code fence from the model's answer, if present."""
+    if '```php' in completion:
+        return completion.split('```php')[1].split('```')[0].strip()
+    if '```' in completion:
+        return completion.split('```')[1].split('```')[0].strip()
+    return completion
+
+
+def _fix_result(file_path: str, content: str, fixed_code: str) -> Dict[str, Any]:
+    """Build the response for one fixed file."""
+    return {
+        "file": file_path,
+        "original_size": len(content),
+        "fixed_size": len(fixed_code),
+        "fixed_code": fixed_code,
+        "status": "success"
+    }
+
 # ============================================================================
 # POST PROCESSORS  
 # ============================================================================
@@ -25,23 +272,19 @@ def process_phpcs_detailed(result: subprocess.CompletedProcess) -> Dict[str, Any
     """Parse PHPCS JSON output for AI processing."""
     try:
         # The output is in result.stdout
-        phpcs_data = json.loads(result.stdout)
+        files = loads(result.stdout).get('files', {}).items()
         
         issues_by_file = []
         total_errors = 0
         total_warnings = 0
         
-        for filepath, file_data in phpcs_data.get('files', {}).items():
-            if file_data.get('errors', 0) > 0 or file_data.get('warnings', 0) > 0:
-                messages = file_data.get('messages', [])
-                
-                issues_by_line = {}
-                for msg in messages:
-                    line = msg['line']
-                    if line not in issues_by_line:
-                        issues_by_line[line] = []
-                    
-                    issues_by_line[line].append({
+        for filepath, file_data in files:
+            errors = file_data.get('errors', 0)
+            warnings = file_data.get('warnings', 0)
+            if errors > 0 or warnings > 0:
+                issues_by_line = defaultdict(list)
+                for msg in file_data.get('messages', []):
+                    issues_by_line[msg['line']].append({
                         'column': msg['column'],
                         'type': msg['type'],
                         'message': msg['message'],
@@ -50,13 +293,13 @@ def process_phpcs_detailed(result: subprocess.CompletedProcess) -> Dict[str, Any
                 
                 issues_by_file.append({
                     'file': filepath.replace('/var/www/html/apps-extra/openregister/', ''),
-                    'errors': file_data.get('errors', 0),
-                    'warnings': file_data.get('warnings', 0),
-                    'issues_by_line': issues_by_line
+                    'errors': errors,
+                    'warnings': warnings,
+                    'issues_by_line': dict(issues_by_line)
                 })
                 
-                total_errors += file_data.get('errors', 0)
-                total_warnings += file_data.get('warnings', 0)
+                total_errors += errors
+                total_warnings += warnings
         
         return {
             "phpcs_issues": issues_by_file,
@@ -79,7 +322,9 @@ COMMANDS = {
         'command': './vendor/bin/phpcs --report=json --standard=PSR12 lib/',
         'timeout': 60,
         'description': 'Get detailed PHPCS issues for AI fixing',
-        'post_processor': process_phpcs_detailed
+        'post_processor': process_phpcs_detailed,
+        # Results are reused while no PHP file under lib/ changes.
+        'fingerprint': "find lib -name '*.php' -printf '%T@ %s %p\\n' | sort | sha1sum"
     },
     
     # Original commands...
@@ -99,18 +344,25 @@ COMMANDS = {
 # HTTP HANDLER
 # ============================================================================
 
-class AICodeFixingHandler(BaseHTTPRequestHandler):
+class AICodeFixingHandler(RequestHelpersMixin, BaseHTTPRequestHandler):
     
     def do_POST(self):
+        """Handle POST requests, at most MAX_CONCURRENT_REQUESTS at a time."""
+        with _request_slots:
+            self._handle_post()
+    
+    def _handle_post(self):
         """Handle POST requests."""
-        path = self.path.lstrip('/')
+        path = self._route()
         
         # File operations need request body
-        if path in ['read-file', 'write-file', 'backup-file']:
+        if path in FILE_OPERATIONS:
             self._handle_file_operation(path)
         # LLM fix operation
         elif path == 'ai-fix-code':
             self._handle_ai_fix()
+        elif path == 'ai-fix-code-batch':
+            self._handle_ai_fix_batch()
         # Regular commands  
         elif path in COMMANDS:
             self._execute_command(path)
@@ -122,18 +374,30 @@ class AICodeFixingHandler(BaseHTTPRequestHandler):
         cmd_config = COMMANDS[cmd_name]
         
         try:
+            cache_key = None
+            if 'fingerprint' in cmd_config:
+                # pipefail: a failing find must fail the fingerprint rather
+                # than yield the digest of empty input.
+                exit_code, digest = _container_exec(
+                    f'set -o pipefail; cd {APP_PATH} && {cmd_config["fingerprint"]}'
+                )
+                if exit_code == 0:
+                    cache_key = (cmd_name, digest.strip())
+                    cached = _result_cache_get(cache_key)
+                    if cached is not None:
+                        self._send_json({**cached, "cached": True})
+                        return
+            
             result = subprocess.run(
-                [
-                    'docker', 'exec', CONTAINER_NAME, 'bash', '-c',
-                    f'cd {APP_PATH} && {cmd_config["command"]} 2>&1'
-                ],
-                capture_output=True,
+                command_argv(cmd_config['command'], CONTAINER_NAME, APP_PATH),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
                 text=True,
                 timeout=cmd_config['timeout']
             )
             
             response = {
-                "timestamp": datetime.utcnow().isoformat() + "Z",
+                "timestamp": now_iso(),
                 "command": cmd_name,
                 "status": "success" if result.returncode == 0 else "completed_with_errors",
                 "exit_code": result.returncode,
@@ -144,6 +408,9 @@ class AICodeFixingHandler(BaseHTTPRequestHandler):
                 extra = cmd_config['post_processor'](result)
                 response.update(extra)
             
+            if cache_key is not None and 'error' not in response:
+                _result_cache_put(cache_key, response)
+            
             self._send_json(response)
             
         except subprocess.TimeoutExpired:
@@ -154,58 +421,99 @@ class AICodeFixingHandler(BaseHTTPRequestHandler):
     def _handle_file_operation(self, operation: str):
         """Handle file read/write/backup."""
         try:
-            content_length = int(self.headers.get('Content-Length', 0))
-            body = json.loads(self.rfile.read(content_length).decode('utf-8'))
+            body = loads(self._read_body())
             
             if operation == 'read-file':
-                result = self._read_file(body.get('file'))
+                self._handle_read_file(body.get('file'))
+                return
             elif operation == 'write-file':
                 result = self._write_file(body.get('file'), body.get('content'))
             elif operation == 'backup-file':
                 result = self._backup_file(body.get('file'))
+            elif operation == 'read-files':
+                result = self._read_files(body.get('files'))
+            elif operation == 'backup-files':
+                result = self._backup_files(body.get('files'))
             
             self._send_json(result)
             
         except Exception as e:
             self._send_error(500, str(e))
     
+    def _handle_read_file(self, file_path: str):
+        """
+        Send a file with its ETag, or 304 if If-None-Match already has it.
+        
+        Only the file's stat is fetched to check the ETag; unchanged files are
+        served from the file cache without reading them again.
+        """
+        full_path = _resolve_app_path(file_path)
+        if full_path is None:
+            self._send_json({"error": "Invalid file path"})
+            return
+        
+        exit_code, stat_line = _container_exec(f'stat -c {_STAT_FORMAT} -- {shlex.quote(full_path)}')
+        if exit_code != 0:
+            self._send_json({"error": "File not found"})
+            return
+        
+        etag = _etag(stat_line)
+        
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match:
+            tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+            if etag in tags or '*' in tags:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+        
+        result = _file_cache_get(file_path, etag)
+        if result is None:
+            result = self._read_file(file_path)
+            if 'error' not in result:
+                # The file may have changed since the stat; use the ETag read with it.
+                etag = result['etag']
+                _file_cache_put(file_path, etag, result)
+        
+        self._send_json(result, headers={'ETag': etag} if 'error' not in result else None)
+    
     def _read_file(self, file_path: str) -> Dict:
-        """Read a file from the container."""
-        if not file_path or '..' in file_path:
+        """Read a file from the container, with the ETag of the version read."""
+        full_path = _resolve_app_path(file_path)
+        if full_path is None:
             return {"error": "Invalid file path"}
         
-        result = subprocess.run(
-            ['docker', 'exec', CONTAINER_NAME, 'bash', '-c', 
-             f'cat {APP_PATH}/{file_path}'],
-            capture_output=True,
-            text=True,
-            timeout=10
-        )
+        # stat and cat in one call, so the ETag matches the content returned.
+        quoted = shlex.quote(full_path)
+        exit_code, output = _container_exec(f'stat -c {_STAT_FORMAT} -- {quoted} && cat -- {quoted}')
         
-        if result.returncode != 0:
+        if exit_code != 0:
             return {"error": "File not found"}
         
+        stat_line, _, content = output.partition('\n')
+        
         return {
             "file": file_path,
-            "content": result.stdout,
-            "size": len(result.stdout),
-            "lines": len(result.stdout.split('\n'))
+            "content": content,
+            "size": len(content),
+            "lines": _count_lines(content),
+            "etag": _etag(stat_line)
         }
     
     def _write_file(self, file_path: str, content: str) -> Dict:
         """Write content to a file."""
-        if not file_path or '..' in file_path:
+        full_path = _resolve_app_path(file_path)
+        if full_path is None:
             return {"error": "Invalid file path"}
         
-        # Use base64 to safely transfer content
-        import base64
-        encoded = base64.b64encode(content.encode('utf-8')).decode('utf-8')
-        
+        # Stream the raw bytes over stdin: no base64 expansion and no
+        # ARG_MAX limit on the file size.
         result = subprocess.run(
-            ['docker', 'exec', CONTAINER_NAME, 'bash', '-c',
-             f'echo "{encoded}" | base64 -d > {APP_PATH}/{file_path}'],
+            ['docker', 'exec', '-i', CONTAINER_NAME, 'bash', '-c',
+             f'cat > {shlex.quote(full_path)}'],
+            input=content.encode('utf-8'),
             capture_output=True,
-            text=True,
             timeout=10
         )
         
@@ -220,21 +528,18 @@ class AICodeFixingHandler(BaseHTTPRequestHandler):
     
     def _backup_file(self, file_path: str) -> Dict:
         """Create a backup of a file."""
-        if not file_path or '..' in file_path:
+        full_path = _resolve_app_path(file_path)
+        if full_path is None:
             return {"error": "Invalid file path"}
         
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         backup_path = f"{file_path}.backup_{timestamp}"
         
-        result = subprocess.run(
-            ['docker', 'exec', CONTAINER_NAME, 'bash', '-c',
-             f'cp {APP_PATH}/{file_path} {APP_PATH}/{backup_path}'],
-            capture_output=True,
-            text=True,
-            timeout=10
+        exit_code, _ = _container_exec(
+            f'cp -- {shlex.quote(full_path)} {shlex.quote(f"{full_path}.backup_{timestamp}")}'
         )
         
-        if result.returncode != 0:
+        if exit_code != 0:
             return {"error": "Failed to create backup"}
         
         return {
@@ -243,11 +548,78 @@ class AICodeFixingHandler(BaseHTTPRequestHandler):
             "timestamp": timestamp
         }
     
+    def _read_files(self, file_paths: List[str]) -> Dict:
+        """Read several files with a single docker exec."""
+        if not file_paths or not isinstance(file_paths, list):
+            return {"error": "Missing 'files' list"}
+        if any(_resolve_app_path(p) is None for p in file_paths):
+            return {"error": "Invalid file path"}
+        
+        # Each file is framed as NUL-separated fields: path, content, exit code.
+        quoted = ' '.join(shlex.quote(p) for p in file_paths)
+        exit_code, output = _container_exec(
+            f'cd {APP_PATH} && for f in {quoted}; do '
+            f'printf "\\0%s\\0" "$f"; cat -- "$f" 2>/dev/null; printf "\\0%d\\0" $?; done',
+            timeout=BATCH_TIMEOUT
+        )
+        
+        if exit_code != 0:
+            return {"error": "Failed to read files"}
+        
+        files = {}
+        errors = {}
+        parts = output.split('\0')
+        for i in range(0, len(parts) - 3, 4):
+            path, content, status = parts[i + 1], parts[i + 2], parts[i + 3]
+            if status != '0':
+                errors[path] = "File not found"
+                continue
+            files[path] = {
+                "content": content,
+                "size": len(content),
+                "lines": _count_lines(content)
+            }
+        
+        return {"files": files, "errors": errors}
+    
+    def _backup_files(self, file_paths: List[str]) -> Dict:
+        """Back up several files with a single docker exec."""
+        if not file_paths or not isinstance(file_paths, list):
+            return {"error": "Missing 'files' list"}
+        if any(_resolve_app_path(p) is None for p in file_paths):
+            return {"error": "Invalid file path"}
+        
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        suffix = f".backup_{timestamp}"
+        
+        # One "path NUL exit-code NUL" record per file.
+        quoted = ' '.join(shlex.quote(p) for p in file_paths)
+        exit_code, output = _container_exec(
+            f'cd {APP_PATH} && for f in {quoted}; do '
+            f'cp -- "$f" "$f{suffix}" 2>/dev/null; printf "%s\\0%d\\0" "$f" $?; done',
+            timeout=BATCH_TIMEOUT
+        )
+        
+        if exit_code != 0:
+            return {"error": "Failed to create backups"}
+        
+        backups = {}
+        errors = {}
+        parts = output.split('\0')
+        for i in range(0, len(parts) - 1, 2):
+            path, status = parts[i], parts[i + 1]
+            if status == '0':
+                backups[path] = f"{path}{suffix}"
+            else:
+                errors[path] = "Failed to create backup"
+        
+        return {"backups": backups, "errors": errors, "timestamp": timestamp}
+    
     def _handle_ai_fix(self):
         """Use Ollama to fix code based on PHPCS issues."""
+        stream = False
         try:
-            content_length = int(self.headers.get('Content-Length', 0))
-            body = json.loads(self.rfile.read(content_length).decode('utf-8'))
+            body = loads(self._read_body())
             
             file_path = body.get('file')
             issues = body.get('issues')
@@ -257,64 +629,135 @@ class AICodeFixingHandler(BaseHTTPRequestHandler):
                 self._send_error(400, "Missing required fields")
                 return
             
-            # Build prompt for LLM
-            prompt = f"""Fix this PHP code according to PSR-12 standards.
-
-Issues found:
-{json.dumps(issues, indent=2)}
-
-Current code:
-```php
-{content}
-```
-
-Provide ONLY the fixed PHP code, no explanations."""
+            prompt = _fix_prompt(issues, content)
+            
+            if _ollama_session is None:
+                self._send_error(500, "The requests package is required for AI fixing")
+                return
             
-            # Call Ollama
-            import requests
-            response = requests.post(
+            # Call Ollama, reading the completion as it is generated
+            response = _ollama_session.post(
                 f'{OLLAMA_URL}/api/generate',
                 json={
                     'model': 'codellama:7b-instruct',
                     'prompt': prompt,
-                    'stream': False,
+                    'stream': True,
                     'options': {'temperature': 0.2}
                 },
-                timeout=60
+                stream=True,
+                timeout=(5, 60)
             )
             
-            if response.status_code != 200:
-                self._send_error(500, "Ollama API error")
+            with response:
+                if response.status_code != 200:
+                    self._send_error(500, "Ollama API error")
+                    return
+                
+                # NDJSON clients get each token as it arrives, then the result
+                stream = body.get('stream') is True or 'application/x-ndjson' in self.headers.get('Accept', '')
+                if stream:
+                    self.send_response(200)
+                    self.send_header('Content-type', 'application/x-ndjson')
+                    self.send_header('Access-Control-Allow-Origin', '*')
+                    self.end_headers()
+                
+                tokens = []
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    chunk = loads(line)
+                    token = chunk.get('response', '')
+                    tokens.append(token)
+                    if stream and token:
+                        self.wfile.write(dumps({"token": token}) + b'\n')
+                        self.wfile.flush()
+                    if chunk.get('done'):
+                        break
+            
+            result = _fix_result(file_path, content, _extract_code(''.join(tokens)))
+            
+            if stream:
+                self.wfile.write(dumps(result) + b'\n')
+            else:
+                self._send_json(result)
+            
+        except (BrokenPipeError, ConnectionResetError):
+            # Client aborted; leaving the with block dropped the Ollama stream.
+            pass
+        except Exception as e:
+            if stream:
+                # Headers are already out; report the failure as the last line.
+                self.wfile.write(dumps({"error": str(e)}) + b'\n')
+            else:
+                self._send_error(500, str(e))
+    
+    def _handle_ai_fix_batch(self):
+        """Fix several files, running their Ollama calls concurrently."""
+        try:
+            body = loads(self._read_body())
+            
+            items = body.get('items')
+            if not items or not isinstance(items, list):
+                self._send_error(400, "Missing 'items' list")
                 return
             
-            fixed_code = response.json().get('response', '')
+            if _ollama_session is None:
+                self._send_error(500, "The requests package is required for AI fixing")
+                return
             
-            # Extract code from markdown if present
-            if '```php' in fixed_code:
-                fixed_code = fixed_code.split('```php')[1].split('```')[0].strip()
-            elif '```' in fixed_code:
-                fixed_code = fixed_code.split('```')[1].split('```')[0].strip()
+            # Ollama batches concurrent generations; results keep item order.
+            with ThreadPoolExecutor(max_workers=min(AI_FIX_WORKERS, len(items))) as pool:
+                results = list(pool.map(self._one_fix, items))
             
-            self._send_json({
-                "file": file_path,
-                "original_size": len(content),
-                "fixed_size": len(fixed_code),
-                "fixed_code": fixed_code,
-                "status": "success"
-            })
+            self._send_json({"results": results})
             
         except Exception as e:
             self._send_error(500, str(e))
     
+    def _one_fix(self, item: Any) -> Dict:
+        """Fix one {file, issues, content} batch item; failures are reported per item."""
+        if not isinstance(item, dict):
+            return {"error": "Invalid item"}
+        
+        file_path = item.get('file')
+        issues = item.get('issues')
+        content = item.get('content')
+        
+        if not all([file_path, issues, content]):
+            return {"file": file_path, "error": "Missing required fields"}
+        
+        try:
+            response = _ollama_session.post(
+                f'{OLLAMA_URL}/api/generate',
+                json={
+                    'model': 'codellama:7b-instruct',
+                    'prompt': _fix_prompt(issues, content),
+                    'stream': False,
+                    'options': {'temperature': 0.2}
+                },
+                timeout=60
+            )
+            
+            if response.status_code != 200:
+                return {"file": file_path, "error": "Ollama API error"}
+            
+            return _fix_result(file_path, content, _extract_code(response.json().get('response', '')))
+            
+        except Exception as e:
+            return {"file": file_path, "error": str(e)}
+    
     def do_GET(self):
         """Show API status."""
-        if self.path == '/':
+        if self._route() == '':
             endpoints = {f"POST /{k}": v.get('description', '') for k, v in COMMANDS.items()}
             endpoints.update({
                 "POST /read-file": "Read a file (body: {file: 'path'})",
                 "POST /write-file": "Write a file (body: {file: 'path', content: '...'})",
                 "POST /backup-file": "Backup a file (body: {file: 'path'})",
+                "POST /read-files": "Read several files in one call (body: {files: ['path', ...]})",
+                "POST /backup-files": "Backup several files in one call (body: {files: ['path', ...]})",
                 "POST /ai-fix-code": "Fix code with AI (body: {file, issues, content})",
+                "POST /ai-fix-code-batch": "Fix several files with AI (body: {items: [{file, issues, content}, ...]})",
             })
             
             status = {
@@ -328,42 +771,59 @@ Provide ONLY the fixed PHP code, no explanations."""
         else:
             self._send_error(404, "Not found")
     
-    def _send_json(self, data: Dict):
-        """Send JSON response."""
+    def _send_json(self, data: Dict, headers: Optional[Dict[str, str]] = None):
+        """Send JSON response, compact unless ?pretty=1 was given."""
+        body = dumps(data, self._pretty)
+        
         self.send_response(200)
         self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
         self.send_header('Access-Control-Allow-Origin', '*')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
         self.end_headers()
-        self.wfile.write(json.dumps(data, indent=2).encode())
+        self.wfile.write(body)
     
     def _send_error(self, code: int, message: str):
         """Send error response."""
+        body = dumps({"error": message})
         self.send_response(code)
         self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
         self.end_headers()
-        self.wfile.write(json.dumps({"error": message}).encode())
+        self.wfile.write(body)
     
     def log_message(self, format, *args):
         """Custom log format."""
         sys.stderr.write(f"[{datetime.now()}] {format % args}\n")
 
+
 # ============================================================================
 # MAIN
 # ============================================================================
 
 if __name__ == '__main__':
-    server = HTTPServer(('localhost', PORT), AICodeFixingHandler)
-    
     print('=' * 70)
     print('OpenRegister AI Code Fixing API v3.0.0')
     print('=' * 70)
     print(f'Port: {PORT}')
+    print(f'Workers: {API_WORKERS}')
     print(f'Container: {CONTAINER_NAME}')
     print(f'Ollama: {OLLAMA_URL}')
     print(f'Model: codellama:7b-instruct')
     print('=' * 70)
     print()
     
+    # Extra worker processes bind PORT too, via SO_REUSEPORT. Caches, the
+    # container shell and the request limit are per process.
+    sys.stdout.flush()
+    for _ in range(API_WORKERS - 1):
+        if os.fork() == 0:
+            break
+    
+    # Threaded: a slow Ollama call or phpqa run no longer blocks other requests.
+    server = TunedHTTPServer(('localhost', PORT), AICodeFixingHandler)
+    
     try:
         server.serve_forever()
     except KeyboardInterrupt:
@@ -8,13 +8,25 @@ Easily extensible for adding new commands.
 Usage: python3 container-api.py
 """
 import json
+import os
 import subprocess
 import sys
 import re
+import threading
 from datetime import datetime
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from http.server import BaseHTTPRequestHandler
 from typing import Dict, Any, Optional, Callable
 
+from api_common import (
+    API_WORKERS,
+    RequestHelpersMixin,
+    TunedHTTPServer,
+    command_argv,
+    dumps,
+    loads,
+    now_iso
+)
+
 # Import AI code fixing module.
 from ai_code_fixing import (
     process_phpcs_result,
@@ -28,6 +40,18 @@ PORT = 9090
 CONTAINER_NAME = 'master-nextcloud-1'
 APP_PATH = '/var/www/html/apps-extra/openregister'
 
+# Upper bound on POST requests running at once, to avoid flooding dockerd
+# with parallel `docker exec` calls (excess requests wait for a slot).
+MAX_CONCURRENT_REQUESTS = 32
+_request_slots = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
+
+# Output patterns used by the post-processors. A "fixed files" line is one
+# mentioning Fixed/fixed; its first "<n> file" count is taken.
+_FIXED_LINE_RE = re.compile(r'^(?=.*[Ff]ixed).*?(\d+)[^\S\n]+file', re.MULTILINE)
+_TESTS_RE = re.compile(r'Tests:\s+(\d+)')
+_ASSERTIONS_RE = re.compile(r'Assertions:\s+(\d+)')
+_FAILURES_RE = re.compile(r'Failures:\s+(\d+)')
+
 
 # ============================================================================
 # COMMAND DEFINITIONS
@@ -83,7 +107,7 @@ def process_phpqa_result(result: subprocess.CompletedProcess) -> Dict[str, Any]:
             timeout=10
         )
         
-        phpqa_json = json.loads(json_result.stdout)
+        phpqa_json = loads(json_result.stdout)
         
         return {
             "phpqa_report": phpqa_json,
@@ -106,14 +130,9 @@ def process_cs_fix_result(result: subprocess.CompletedProcess) -> Dict[str, Any]
     :param result: The completed subprocess result.
     :return: Additional data to include in the response.
     """
-    output_lines = result.stdout.split('\n')
-    files_fixed = 0
-    
-    for line in output_lines:
-        if 'Fixed' in line or 'fixed' in line:
-            match = re.search(r'(\d+)\s+file', line)
-            if match:
-                files_fixed = int(match.group(1))
+    # The last matching line wins.
+    counts = _FIXED_LINE_RE.findall(result.stdout)
+    files_fixed = int(counts[-1]) if counts else 0
     
     return {
         "files_fixed": files_fixed,
@@ -131,9 +150,9 @@ def process_test_result(result: subprocess.CompletedProcess) -> Dict[str, Any]:
     output = result.stdout
     
     # Try to extract test statistics.
-    tests_match = re.search(r'Tests:\s+(\d+)', output)
-    assertions_match = re.search(r'Assertions:\s+(\d+)', output)
-    failures_match = re.search(r'Failures:\s+(\d+)', output)
+    tests_match = _TESTS_RE.search(output)
+    assertions_match = _ASSERTIONS_RE.search(output)
+    failures_match = _FAILURES_RE.search(output)
     
     return {
         "tests_run": int(tests_match.group(1)) if tests_match else 0,
@@ -259,13 +278,17 @@ for cmd_name, cmd_data in AI_COMMANDS.items():
 # HTTP REQUEST HANDLER
 # ============================================================================
 
-class ContainerAPIHandler(BaseHTTPRequestHandler):
+class ContainerAPIHandler(RequestHelpersMixin, BaseHTTPRequestHandler):
     """Handle HTTP requests for container command execution."""
     
     def do_POST(self):
+        """Handle POST requests, at most MAX_CONCURRENT_REQUESTS at a time."""
+        with _request_slots:
+            self._handle_post()
+    
+    def _handle_post(self):
         """Handle POST requests to execute commands."""
-        # Remove leading slash from path.
-        command_name = self.path.lstrip('/')
+        command_name = self._route()
         
         # Handle special file operation commands.
         if command_name in ['read-file', 'write-file', 'backup-file']:
@@ -275,14 +298,11 @@ class ContainerAPIHandler(BaseHTTPRequestHandler):
         if command_name in COMMANDS:
             self._execute_command(COMMANDS[command_name])
         else:
-            self.send_response(404)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
             error = {
                 "error": f"Unknown command: {command_name}",
                 "available_commands": list(COMMANDS.keys()) + ['read-file', 'write-file', 'backup-file']
             }
-            self.wfile.write(json.dumps(error, indent=2).encode())
+            self._send_json(error, 404)
     
     def _handle_file_operation(self, operation: str):
         """
@@ -294,15 +314,11 @@ class ContainerAPIHandler(BaseHTTPRequestHandler):
             # Read request body.
             content_length = int(self.headers.get('Content-Length', 0))
             if content_length == 0:
-                self.send_response(400)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
                 error = {"error": "Request body required"}
-                self.wfile.write(json.dumps(error).encode())
+                self._send_json(error, 400)
                 return
             
-            body = self.rfile.read(content_length)
-            request_data = json.loads(body.decode('utf-8'))
+            request_data = loads(self._read_body(content_length))
             
             # Call the appropriate handler.
             if operation == 'read-file':
@@ -316,31 +332,21 @@ class ContainerAPIHandler(BaseHTTPRequestHandler):
             
             # Send response.
             response_data = {
-                "timestamp": datetime.utcnow().isoformat() + "Z",
+                "timestamp": now_iso(),
                 "operation": operation,
                 "container": CONTAINER_NAME,
                 **result
             }
             
             status_code = 200 if "error" not in result else 400
-            self.send_response(status_code)
-            self.send_header('Content-type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.end_headers()
-            self.wfile.write(json.dumps(response_data, indent=2).encode())
+            self._send_json(response_data, status_code)
             
         except json.JSONDecodeError:
-            self.send_response(400)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
             error = {"error": "Invalid JSON in request body"}
-            self.wfile.write(json.dumps(error).encode())
+            self._send_json(error, 400)
         except Exception as e:
-            self.send_response(500)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
             error = {"error": str(e)}
-            self.wfile.write(json.dumps(error).encode())
+            self._send_json(error, 500)
     
     def _execute_command(self, cmd_config: CommandConfig):
         """
@@ -350,24 +356,25 @@ class ContainerAPIHandler(BaseHTTPRequestHandler):
         """
         print(f"[{datetime.now()}] Running {cmd_config.name}: {cmd_config.command}", file=sys.stderr)
         
+        # Without a post-processor nothing needs the whole output at once;
+        # ?pretty=1 needs it too, to indent the response.
+        if cmd_config.post_processor is None and not self._pretty:
+            self._stream_command(cmd_config)
+            return
+        
         try:
-            # Build the full docker exec command.
-            docker_cmd = [
-                'docker', 'exec', CONTAINER_NAME, 'bash', '-c',
-                f'cd {APP_PATH} && {cmd_config.command} 2>&1'
-            ]
-            
             # Execute the command.
             result = subprocess.run(
-                docker_cmd,
-                capture_output=True,
+                command_argv(cmd_config.command, CONTAINER_NAME, APP_PATH),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
                 text=True,
                 timeout=cmd_config.timeout
             )
             
             # Build base response.
             response_data = {
-                "timestamp": datetime.utcnow().isoformat() + "Z",
+                "timestamp": now_iso(),
                 "command": cmd_config.name,
                 "full_command": cmd_config.command,
                 "status": "success" if result.returncode == 0 else "completed_with_errors",
@@ -385,11 +392,7 @@ class ContainerAPIHandler(BaseHTTPRequestHandler):
                     response_data["post_processor_error"] = str(e)
             
             # Send response.
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.end_headers()
-            self.wfile.write(json.dumps(response_data, indent=2).encode())
+            self._send_json(response_data)
             
             print(
                 f"[{datetime.now()}] {cmd_config.name} completed with exit code {result.returncode}",
@@ -397,34 +400,120 @@ class ContainerAPIHandler(BaseHTTPRequestHandler):
             )
             
         except subprocess.TimeoutExpired:
-            self.send_response(408)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
             error_response = {
                 "error": f"Request timeout after {cmd_config.timeout} seconds",
                 "command": cmd_config.name
             }
-            self.wfile.write(json.dumps(error_response, indent=2).encode())
+            self._send_json(error_response, 408)
             print(f"[{datetime.now()}] {cmd_config.name} timed out", file=sys.stderr)
             
         except Exception as e:
-            self.send_response(500)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
             error_response = {
                 "error": str(e),
                 "command": cmd_config.name
             }
-            self.wfile.write(json.dumps(error_response, indent=2).encode())
+            self._send_json(error_response, 500)
             print(f"[{datetime.now()}] {cmd_config.name} failed: {e}", file=sys.stderr)
     
-    def do_GET(self):
-        """Handle GET requests - show status and available commands."""
-        if self.path == '/':
+    def _stream_command(self, cmd_config: CommandConfig):
+        """
+        Execute a command and stream its output to the client as it runs.
+        
+        The response is the same JSON object _execute_command sends, written
+        incrementally: the "output" string is emitted line by line and the
+        exit code follows once the command ends. A timeout before the first
+        output line gets the usual 408; after it, the 200 status line is
+        already out, so the timeout is reported in the body instead.
+        
+        :param cmd_config: The command configuration to execute.
+        """
+        try:
+            proc = subprocess.Popen(
+                command_argv(cmd_config.command, CONTAINER_NAME, APP_PATH),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT
+            )
+        except OSError as e:
+            error_response = {
+                "error": str(e),
+                "command": cmd_config.name
+            }
+            self._send_json(error_response, 500)
+            print(f"[{datetime.now()}] {cmd_config.name} failed: {e}", file=sys.stderr)
+            return
+        
+        # Kill the command even while we are blocked reading its output.
+        timed_out = threading.Event()
+        
+        def _kill_on_timeout() -> None:
+            timed_out.set()
+            proc.kill()
+        
+        timer = threading.Timer(cmd_config.timeout, _kill_on_timeout)
+        timer.start()
+        
+        try:
+            first_line = proc.stdout.readline()
+            if timed_out.is_set():
+                proc.wait()
+                error_response = {
+                    "error": f"Request timeout after {cmd_config.timeout} seconds",
+                    "command": cmd_config.name
+                }
+                self._send_json(error_response, 408)
+                print(f"[{datetime.now()}] {cmd_config.name} timed out", file=sys.stderr)
+                return
+            
+            # No Content-Length: the body ends when the connection closes.
             self.send_response(200)
             self.send_header('Content-type', 'application/json')
+            self.send_header('Access-Control-Allow-Origin', '*')
             self.end_headers()
             
+            head = json.dumps({
+                "timestamp": now_iso(),
+                "command": cmd_config.name,
+                "full_command": cmd_config.command,
+                "container": CONTAINER_NAME
+            })
+            self.wfile.write(f'{head[:-1]}, "output": "'.encode())
+            self.wfile.flush()
+            
+            line = first_line
+            while line:
+                # Strip the quotes to splice the escaped line into the open string.
+                self.wfile.write(json.dumps(line.decode('utf-8', errors='replace'))[1:-1].encode())
+                self.wfile.flush()
+                line = proc.stdout.readline()
+            
+            returncode = proc.wait()
+            tail = {
+                "status": "success" if returncode == 0 else "completed_with_errors",
+                "exit_code": returncode
+            }
+            if timed_out.is_set():
+                tail["status"] = "timeout"
+                tail["error"] = f"Request timeout after {cmd_config.timeout} seconds"
+            self.wfile.write(f'", {json.dumps(tail)[1:]}'.encode())
+            
+            print(
+                f"[{datetime.now()}] {cmd_config.name} completed with exit code {returncode}",
+                file=sys.stderr
+            )
+            
+        except (BrokenPipeError, ConnectionResetError):
+            # Client went away; stop the command rather than let it run on.
+            proc.kill()
+            print(f"[{datetime.now()}] {cmd_config.name} aborted by client", file=sys.stderr)
+            
+        finally:
+            timer.cancel()
+            proc.stdout.close()
+            proc.wait()
+    
+    def do_GET(self):
+        """Handle GET requests - show status and available commands."""
+        if self._route() == '':
             # Build endpoint list.
             endpoints = {}
             for cmd_name, cmd_config in COMMANDS.items():
@@ -439,11 +528,27 @@ class ContainerAPIHandler(BaseHTTPRequestHandler):
                 "endpoints": endpoints,
                 "usage": f"POST /<command_name> to execute a command"
             }
-            self.wfile.write(json.dumps(status, indent=2).encode())
+            self._send_json(status)
         else:
             self.send_response(404)
             self.end_headers()
     
+    def _send_json(self, data: Dict[str, Any], status_code: int = 200):
+        """
+        Send a JSON response with a Content-Length.
+        
+        :param data: The response body.
+        :param status_code: The HTTP status code.
+        """
+        body = dumps(data, self._pretty)
+        
+        self.send_response(status_code)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(body)
+    
     def log_message(self, format, *args):
         """Custom log format."""
         sys.stderr.write(f"[{datetime.now()}] {format % args}\n")
@@ -454,12 +559,11 @@ class ContainerAPIHandler(BaseHTTPRequestHandler):
 # ============================================================================
 
 if __name__ == '__main__':
-    server = HTTPServer(('localhost', PORT), ContainerAPIHandler)
-    
     print('=' * 70)
     print(f'OpenRegister Container API Server v2.0.0')
     print('=' * 70)
     print(f'Port: {PORT}')
+    print(f'Workers: {API_WORKERS}')
     print(f'Container: {CONTAINER_NAME}')
     print(f'App Path: {APP_PATH}')
     print()
@@ -472,6 +576,17 @@ if __name__ == '__main__':
     print('=' * 70)
     print()
     
+    # Extra worker processes bind PORT too, via SO_REUSEPORT. The request
+    # limit is per process.
+    sys.stdout.flush()
+    for _ in range(API_WORKERS - 1):
+        if os.fork() == 0:
+            break
+    
+    # One thread per request, so a long-running command (e.g. a 300 s
+    # phpqa) does not block file operations or other commands.
+    server = TunedHTTPServer(('localhost', PORT), ContainerAPIHandler)
+    
     try:
         server.serve_forever()
     except KeyboardInterrupt:
@@ -3,63 +3,204 @@
 Simple API server to run composer phpqa in OpenRegister.
 Usage: python3 phpqa-api.py
 """
+import gzip
 import json
+import os
+import re
+import socket
 import subprocess
 import sys
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional
+
+from api_common import ContainerShell, dumps, loads
+
+# zstandard is optional; without it only gzip is offered.
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 PORT = 9090
 
+# Trailing lines of cs:fix output kept for the response.
+CS_FIX_OUTPUT_LINES = 500
+
+# Number of files on a cs:fix "fixed" line.
+_FILE_RE = re.compile(r'(\d+)\s+file')
+
+# docker exec jobs run on this bounded pool; each one also costs a containerd
+# exec, so further requests queue rather than piling onto the daemon.
+EXECUTOR = ThreadPoolExecutor(max_workers=int(os.environ.get('PHPQA_WORKERS', '4')))
+
+# Each EXECUTOR thread keeps its own `docker exec -i bash` session.
+_worker = threading.local()
+
+
+def _worker_shell() -> ContainerShell:
+    """
+    Return the calling pool thread's long-lived container shell.
+    
+    Container entry is paid once per worker instead of once per call, and a
+    worker runs one job at a time, so jobs never queue behind each other's
+    shell. A session killed on timeout is restarted by the next job.
+    """
+    shell = getattr(_worker, 'shell', None)
+    if shell is None:
+        shell = _worker.shell = ContainerShell('master-nextcloud-1')
+    return shell
+
+
+def _shell_exec(command: str, timeout: float, on_line: Callable[[str], None]) -> int:
+    """Run command in the worker's shell, passing output lines to on_line; return its exit status."""
+    exit_code, _ = _worker_shell().run(command, timeout, on_line)
+    return exit_code
+
+
+def _shell_run(command: str, timeout: float) -> subprocess.CompletedProcess:
+    """Run command in the worker's shell and return its full output."""
+    exit_code, output = _worker_shell().run(command, timeout)
+    return subprocess.CompletedProcess(command, exit_code, output.decode('utf-8', errors='replace'))
+
+
+REPORT_PATH = '/var/www/html/apps-extra/openregister/phpqa/phpqa.json'
+
+# Printed between composer's output and the report in the phpqa exec.
+_REPORT_SEPARATOR = '===JSON==='
+
+# composer phpqa, then the JSON report after a separator, so both come back
+# from one exec.
+_PHPQA_COMMAND = (
+    'cd /var/www/html/apps-extra/openregister && composer phpqa 2>&1; '
+    f'status=$?; printf \'\\n%s\\n\' {_REPORT_SEPARATOR}; '
+    f'cat {REPORT_PATH} 2>/dev/null; '
+    'exit $status'
+)
+
+
+def _phpqa_job():
+    """
+    Run composer phpqa and parse the report it leaves behind.
+    
+    Runs on an EXECUTOR thread. Returns the exit code, composer's output and
+    the parsed report; a missing report yields {}.
+    """
+    result = _shell_run(_PHPQA_COMMAND, 300)  # 5 minute timeout.
+    command_output, _, content = result.stdout.rpartition(f'\n{_REPORT_SEPARATOR}\n')
+    if not content:
+        return result.returncode, command_output, {}
+    
+    try:
+        report = loads(content)
+    except json.JSONDecodeError:
+        report = {"error": "Failed to parse phpqa.json"}
+    return result.returncode, command_output, report
+
+
+# The phpqa run in progress, shared by every /phpqa request that arrives
+# while it is running.
+_inflight = {'phpqa': None}
+_inflight_lock = threading.Lock()
+
+
+def _phpqa_future() -> Future:
+    """Return the running phpqa job's future, starting a job if none is."""
+    with _inflight_lock:
+        future = _inflight['phpqa']
+        if future is not None:
+            return future
+        future = _inflight['phpqa'] = EXECUTOR.submit(_phpqa_job)
+    
+    def _clear(done: Future) -> None:
+        with _inflight_lock:
+            if _inflight['phpqa'] is done:
+                _inflight['phpqa'] = None
+    
+    # Outside the lock: a job that already finished runs the callback here.
+    future.add_done_callback(_clear)
+    return future
+
+
+# GET / never changes, so its body is serialised once.
+_STATUS = {
+    "service": "OpenRegister PHPQA API",
+    "status": "running",
+    "endpoints": {
+        "POST /phpqa": "Run composer phpqa and return results",
+        "POST /cs-fix": "Run composer cs:fix to automatically fix code style issues"
+    }
+}
+_STATUS_BODY = dumps(_STATUS, pretty=True)
+
 
 class PHPQAHandler(BaseHTTPRequestHandler):
+    # Keep-alive: every response carries Content-Length, so pollers can reuse
+    # their connection. Idle connections are closed after the timeout.
+    protocol_version = 'HTTP/1.1'
+    timeout = 60
+    
+    def setup(self):
+        """Disable Nagle, so a response is sent as soon as it is written."""
+        super().setup()
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    
+    def _send(self, code: int, body: bytes, headers: Optional[Dict[str, str]] = None):
+        """Send a JSON response: status line, headers and body in one write."""
+        self.log_request(code)
+        lines = [
+            f'{self.protocol_version} {code} {self.responses[code][0]}',
+            f'Server: {self.version_string()}',
+            f'Date: {self.date_time_string()}',
+            'Content-Type: application/json',
+            f'Content-Length: {len(body)}',
+            'Access-Control-Allow-Origin: *',
+        ]
+        lines.extend(f'{name}: {value}' for name, value in (headers or {}).items())
+        self.wfile.write('\r\n'.join(lines).encode('latin-1') + b'\r\n\r\n' + body)
+    
+    def _send_not_found(self):
+        """Send an empty 404."""
+        self.send_response(404)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+    
     def do_POST(self):
         """Handle POST requests to run PHPQA or CS:FIX."""
+        # No endpoint takes a body, but it must be consumed so the next
+        # request on the connection starts at the right place.
+        length = int(self.headers.get('Content-Length') or 0)
+        while length > 0:
+            chunk = self.rfile.read(min(length, 65536))
+            if not chunk:
+                break
+            length -= len(chunk)
+        
         if self.path == '/phpqa':
             self._run_phpqa()
         elif self.path == '/cs-fix':
             self._run_cs_fix()
         else:
-            self.send_response(404)
-            self.end_headers()
+            self._send_not_found()
     
     def _run_phpqa(self):
         """Run composer phpqa in the container."""
         print(f"[{datetime.now()}] Running composer phpqa...", file=sys.stderr)
         
         try:
-            # Run composer phpqa in the container.
-            result = subprocess.run(
-                [
-                    'docker', 'exec', 'master-nextcloud-1', 'bash', '-c',
-                    'cd /var/www/html/apps-extra/openregister && composer phpqa 2>&1'
-                ],
-                capture_output=True,
-                text=True,
-                timeout=300  # 5 minute timeout.
-            )
-            
-            # Try to get the JSON report.
-            json_result = subprocess.run(
-                [
-                    'docker', 'exec', 'master-nextcloud-1', 'bash', '-c',
-                    'cat /var/www/html/apps-extra/openregister/phpqa/phpqa.json 2>/dev/null || echo "{}"'
-                ],
-                capture_output=True,
-                text=True
-            )
-            
-            try:
-                phpqa_json = json.loads(json_result.stdout)
-            except json.JSONDecodeError:
-                phpqa_json = {"error": "Failed to parse phpqa.json"}
+            # Run composer phpqa in the container, or wait on the run another
+            # request already started.
+            returncode, command_output, phpqa_json = _phpqa_future().result()
             
             # Build response.
             response_data = {
                 "timestamp": datetime.utcnow().isoformat() + "Z",
-                "status": "success" if result.returncode == 0 else "completed_with_issues",
-                "exit_code": result.returncode,
-                "command_output": result.stdout,
+                "status": "success" if returncode == 0 else "completed_with_issues",
+                "exit_code": returncode,
+                "command_output": command_output,
                 "phpqa_report": phpqa_json,
                 "report_files": {
                     "json": "phpqa/phpqa.json",
@@ -68,106 +209,92 @@ class PHPQAHandler(BaseHTTPRequestHandler):
                 }
             }
             
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.end_headers()
-            self.wfile.write(json.dumps(response_data, indent=2).encode())
+            body, encoding = self._encode_body(dumps(response_data, pretty=True))
+            
+            headers = {'Vary': 'Accept-Encoding'}
+            if encoding:
+                headers['Content-Encoding'] = encoding
+            self._send(200, body, headers)
             
-            print(f"[{datetime.now()}] PHPQA completed with exit code {result.returncode}", file=sys.stderr)
+            print(f"[{datetime.now()}] PHPQA completed with exit code {returncode}", file=sys.stderr)
             
         except subprocess.TimeoutExpired:
-            self.send_response(408)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            error_response = {"error": "Request timeout after 5 minutes"}
-            self.wfile.write(json.dumps(error_response).encode())
+            self._send(408, dumps({"error": "Request timeout after 5 minutes"}))
             
         except Exception as e:
-            self.send_response(500)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            error_response = {"error": str(e)}
-            self.wfile.write(json.dumps(error_response).encode())
+            self._send(500, dumps({"error": str(e)}))
+    
+    def _encode_body(self, payload: bytes):
+        """
+        Compress payload for the client's Accept-Encoding.
+        
+        Prefers zstd (when zstandard is installed) over gzip, and returns
+        the body with its Content-Encoding, or None when sent as is.
+        """
+        accepted = {
+            item.partition(';')[0].strip().lower()
+            for item in self.headers.get('Accept-Encoding', '').split(',')
+        }
+        
+        if zstandard is not None and 'zstd' in accepted:
+            return zstandard.ZstdCompressor(level=3).compress(payload), 'zstd'
+        if 'gzip' in accepted:
+            return gzip.compress(payload, compresslevel=1), 'gzip'
+        return payload, None
     
     def _run_cs_fix(self):
         """Run composer cs:fix in the container."""
         print(f"[{datetime.now()}] Running composer cs:fix...", file=sys.stderr)
         
         try:
-            # Run composer cs:fix in the container.
-            result = subprocess.run(
-                [
-                    'docker', 'exec', 'master-nextcloud-1', 'bash', '-c',
-                    'cd /var/www/html/apps-extra/openregister && composer cs:fix 2>&1'
-                ],
-                capture_output=True,
-                text=True,
-                timeout=120  # 2 minute timeout.
-            )
-            
-            # Count files fixed (parse output).
-            output_lines = result.stdout.split('\n')
+            # Run composer cs:fix in the container, counting files fixed
+            # (parse output) as lines arrive; only the tail is kept.
+            output_tail = deque(maxlen=CS_FIX_OUTPUT_LINES)
             files_fixed = 0
-            for line in output_lines:
+            
+            def _on_line(line: str) -> None:
+                nonlocal files_fixed
+                output_tail.append(line)
                 if 'Fixed' in line or 'fixed' in line:
                     # Try to extract number of files fixed.
-                    import re
-                    match = re.search(r'(\d+)\s+file', line)
+                    match = _FILE_RE.search(line)
                     if match:
                         files_fixed = int(match.group(1))
             
+            returncode = EXECUTOR.submit(
+                _shell_exec,
+                'cd /var/www/html/apps-extra/openregister && composer cs:fix 2>&1',
+                120,  # 2 minute timeout.
+                _on_line
+            ).result()
+            
             # Build response.
             response_data = {
                 "timestamp": datetime.utcnow().isoformat() + "Z",
                 "action": "cs:fix",
-                "status": "success" if result.returncode == 0 else "completed_with_errors",
-                "exit_code": result.returncode,
+                "status": "success" if returncode == 0 else "completed_with_errors",
+                "exit_code": returncode,
                 "files_fixed": files_fixed,
-                "command_output": result.stdout,
+                "command_output": ''.join(output_tail),
                 "message": f"Fixed {files_fixed} file(s)" if files_fixed > 0 else "No files needed fixing"
             }
             
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.end_headers()
-            self.wfile.write(json.dumps(response_data, indent=2).encode())
+            self._send(200, dumps(response_data, pretty=True))
             
-            print(f"[{datetime.now()}] CS:FIX completed with exit code {result.returncode}, fixed {files_fixed} files", file=sys.stderr)
+            print(f"[{datetime.now()}] CS:FIX completed with exit code {returncode}, fixed {files_fixed} files", file=sys.stderr)
             
         except subprocess.TimeoutExpired:
-            self.send_response(408)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            error_response = {"error": "Request timeout after 2 minutes"}
-            self.wfile.write(json.dumps(error_response).encode())
+            self._send(408, dumps({"error": "Request timeout after 2 minutes"}))
             
         except Exception as e:
-            self.send_response(500)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            error_response = {"error": str(e)}
-            self.wfile.write(json.dumps(error_response).encode())
+            self._send(500, dumps({"error": str(e)}))
     
     def do_GET(self):
         """Handle GET requests - show status."""
         if self.path == '/':
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            status = {
-                "service": "OpenRegister PHPQA API",
-                "status": "running",
-                "endpoints": {
-                    "POST /phpqa": "Run composer phpqa and return results",
-                    "POST /cs-fix": "Run composer cs:fix to automatically fix code style issues"
-                }
-            }
-            self.wfile.write(json.dumps(status, indent=2).encode())
+            self._send(200, _STATUS_BODY)
         else:
-            self.send_response(404)
-            self.end_headers()
+            self._send_not_found()
     
     def log_message(self, format, *args):
         """Custom log format."""
@@ -175,7 +302,9 @@ class PHPQAHandler(BaseHTTPRequestHandler):
 
 
 if __name__ == '__main__':
-    server = HTTPServer(('localhost', PORT), PHPQAHandler)
+    # Each request gets its own thread, so a 5 minute phpqa run does not
+    # hold up cs-fix or status requests.
+    server = ThreadingHTTPServer(('localhost', PORT), PHPQAHandler)
     print(f'Starting PHPQA API server on port {PORT}...')
     print(f'Test with: curl -X POST http://localhost:{PORT}/phpqa')
     print()